@@ -3,81 +3,161 @@ import numpy as np
 import threading
 import time
 import os
+from collections import deque
+from functools import lru_cache, partial
+
+# Bundled samples live next to this module
+_AUDIO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audios")
+
+# Arpeggio shape relative to the root scale index: Root, +2, +4, +2
+_ARP_OFFSETS = (0, 2, 4, 2)
+
+
+def _ensure_mixer(frequency=44100, channels=2, buffer=512):
+    # Open the mixer once; later engines (and anything else that already
+    # opened it) reuse the existing device instead of re-initializing, so the
+    # requested layout only applies to whoever opens it first
+    init = pygame.mixer.get_init()
+    if not init:
+        pygame.mixer.init(frequency=frequency, size=-16, channels=channels, buffer=buffer)
+    elif init[2] != channels:
+        print(f"Warning: mixer already open with {init[2]} channel(s), ignoring channels={channels}")
+
+@lru_cache(maxsize=8)
+def _synth_envelope(samples, attack):
+    # Attack/Decay curve pre-scaled to int16 full scale, shared read-only
+    # between engines (the processor builds a fresh engine per session)
+    envelope = np.empty(samples, dtype=np.float32)
+    envelope[:attack] = np.linspace(0, 1, attack, dtype=np.float32) # Attack
+    envelope[attack:] = np.linspace(1, 0, samples - attack, dtype=np.float32) # Decay
+    envelope *= np.float32(32767)
+    envelope.setflags(write=False)
+    return envelope
 
 class AudioEngine:
-    def __init__(self, assets_path=None):
+    ARP_HANDS = 2 # One arpeggio per tracked hand
+    # Notes last 200 ms but a 16th step is only 75 ms at 200 BPM, so each hand
+    # rotates through enough voices for every note's tail to decay on its own
+    # (4 x 75 ms > 200 ms); 4 also lines up with the 16-step bar
+    ARP_VOICES = 4
+    ARP_CHANNELS = ARP_HANDS * ARP_VOICES
+    MIXER_CHANNELS = 16 # Reserved arp/drum voices plus headroom for everything else
+    # C Minor Pentatonic: C, Eb, F, G, Bb
+    BASE_FREQS = np.array([130.81, 155.56, 174.61, 196.00, 233.08]) # C3 - Bb3
+    OCTAVE_MULTIPLIERS = np.array([1.0, 2.0, 4.0]) # 3 Octaves
+    # Map drum names to existing filenames if they differ, or just use the names
+    # Existing files: kick.wav, snare.wav, hihat.wav, crashcymbal.wav, hightom.wav
+    # The user code asked for: kick, snare, hihat, clap. 
+    # I will map 'clap' to 'crashcymbal' or just load what's available.
+    # Let's try to load the requested ones, and maybe map clap to crash if clap doesn't exist.
+    DRUM_FILES = {
+        'kick': 'kick.wav',
+        'snare': 'snare.wav',
+        'hihat': 'hihat.wav',
+        'clap': 'crashcymbal.wav' # Fallback/Mapping
+    }
+    DRUM_VOLUMES = {'kick': 0.5, 'hihat': 0.8} # Others play at full level
+    PLAYED_HIT_MAX_AGE_NS = 250_000_000 # Older hits are stale by the time the UI drains them
+
+    def __init__(self, assets_path=None, buffer=512, mono=False, verbose=False):
+        # verbose: log pattern switches (callers like the gesture processor
+        # already report them, so it is off by default)
+        self.verbose = verbose
+        
         # Initialize mixer with appropriate settings
-        # Check if mixer is already initialized to avoid errors
-        if not pygame.mixer.get_init():
-            pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=512)
+        # Stereo by default: some drum samples (snare, crash) are true stereo and
+        # a mono mixer would downmix them. Mono halves the mixing work when every
+        # sample is known to be mono.
+        # buffer trades output latency against underruns on slow machines.
+        # Both only take effect if this engine is the one that opens the mixer.
+        _ensure_mixer(channels=1 if mono else 2, buffer=buffer)
         
-        if assets_path is None:
-            # Robustly find assets folder relative to this script
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            # Changed from "assets" to "audios" to match existing project structure
-            self.assets_path = os.path.join(base_dir, "audios")
-        else:
-            self.assets_path = assets_path
+        # Changed from "assets" to "audios" to match existing project structure
+        self.assets_path = _AUDIO_DIR if assets_path is None else assets_path
         
         # Load Drums
         self.drums = {}
-        # Map drum names to existing filenames if they differ, or just use the names
-        # Existing files: kick.wav, snare.wav, hihat.wav, crashcymbal.wav, hightom.wav
-        # The user code asked for: kick, snare, hihat, clap. 
-        # I will map 'clap' to 'crashcymbal' or just load what's available.
-        # Let's try to load the requested ones, and maybe map clap to crash if clap doesn't exist.
-        
-        drum_files = {
-            'kick': 'kick.wav',
-            'snare': 'snare.wav',
-            'hihat': 'hihat.wav',
-            'clap': 'crashcymbal.wav' # Fallback/Mapping
-        }
-
-        for name, filename in drum_files.items():
+        for name, filename in self.DRUM_FILES.items():
             path = os.path.join(self.assets_path, filename)
-            if os.path.exists(path):
-                self.drums[name] = pygame.mixer.Sound(path)
-                # Adjust volumes to match JS
-                if name == 'kick': self.drums[name].set_volume(0.5)
-                elif name == 'hihat': self.drums[name].set_volume(0.8)
-            else:
+            try:
+                sound = pygame.mixer.Sound(path)
+            except FileNotFoundError:
                 print(f"Warning: Could not find {path}")
+            else:
+                # Adjust volumes to match JS, baked into the samples once so the
+                # mixer doesn't scale every sample on every hit
+                volume = self.DRUM_VOLUMES.get(name, 1.0)
+                if volume != 1.0:
+                    pcm = pygame.sndarray.array(sound)
+                    sound = pygame.sndarray.make_sound(np.rint(pcm * volume).astype(np.int16))
+                self.drums[name] = sound
 
         # Synth State
         self.scale = self._generate_scale_frequencies()
+        # MIDI note per scale index, so callers don't redo log2 per frame
+        self.scale_midi = (69 + 12 * np.log2(self.scale / 440)).astype(int).tolist()
         self.synth_sounds = self._precompute_synth_sounds()
         self.active_arpeggios = {} # hand_index -> {pattern, current_note_index, ...}
+        # Channels must exist before they can be addressed below
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), self.MIXER_CHANNELS))
+        # A block of ARP_VOICES reserved channels per hand, played round-robin;
+        # volume is set on the channel instead of the shared Sound
+        self.arp_channels = [
+            tuple(pygame.mixer.Channel(hand * self.ARP_VOICES + voice) for voice in range(self.ARP_VOICES))
+            for hand in range(self.ARP_HANDS)
+        ]
         
         # Drum Pattern State
-        # Drum Pattern State
+        # Each drum gets a bit index; patterns are compiled to one bitmask of
+        # drums per step so the scheduler only needs an AND per tick. Drums whose
+        # sample failed to load get no index, so their bit is never set and the
+        # play loops below don't need to check for a missing sound
+        self.drum_names = ('kick', 'snare', 'hihat', 'clap')
+        self.drum_idx = {name: i for i, name in enumerate(self.drum_names) if name in self.drums}
+        self.drum_sounds = tuple(self.drums.get(name) for name in self.drum_names)
+        # One fixed voice per drum right after the arp channels; a new hit chokes
+        # the previous one instead of pygame searching for (or stealing) a channel
+        self.drum_channels = tuple(
+            pygame.mixer.Channel(self.ARP_CHANNELS + i) for i in range(len(self.drum_names))
+        )
+        # Reserve both blocks so plain Sound.play() elsewhere never lands on them
+        pygame.mixer.set_reserved(self.ARP_CHANNELS + len(self.drum_names))
+        # Pre-bound "play this drum on its channel" calls (None if the sample is
+        # missing, which drum_idx guarantees is never reached)
+        self.drum_play = tuple(
+            partial(channel.play, sound) if sound is not None else None
+            for channel, sound in zip(self.drum_channels, self.drum_sounds)
+        )
         self.patterns = self._initialize_patterns()
+        self.pattern_masks = [self._compile_pattern(p) for p in self.patterns]
         self.current_pattern_index = 0
         self.drum_pattern = self.patterns[0]
+        self.step_masks = self.pattern_masks[0]
         self.active_drums = set()
-        self.active_drums = set()
+        self.active_mask = 0
+        # Drum hits the scheduler actually played, as (perf_counter_ns, bitmask)
+        # per step, for the UI to drain; deque append/popleft are atomic, so no
+        # lock is needed
+        self.played_hits = deque(maxlen=16)
         
         # Scheduler State
         self.bpm = 100
         self.step_duration = (60 / self.bpm) / 4 # 16th notes
+        # Same duration in integer nanoseconds for the scheduler clock
+        self.step_duration_ns = int(15e9 / self.bpm)
         self.current_step = 0
         self.running = True
-        self.lock = threading.RLock()
+        self.lock = threading.Lock()
+        # Lets cleanup() interrupt the wait for the next step
+        self._wake = threading.Event()
         
         # Start Scheduler Thread
         self.scheduler_thread = threading.Thread(target=self._scheduler_loop, daemon=True)
         self.scheduler_thread.start()
 
     def _generate_scale_frequencies(self):
-        # C Minor Pentatonic: C, Eb, F, G, Bb
-        # Generate a few octaves
-        base_freqs = [130.81, 155.56, 174.61, 196.00, 233.08] # C3 - Bb3
-        scale = []
-        for i in range(3): # 3 Octaves
-            multiplier = 2**i
-            for f in base_freqs:
-                scale.append(f * multiplier)
-        return scale
+        # 3 octaves of the base scale, as one (octave x note) outer product
+        return np.outer(self.OCTAVE_MULTIPLIERS, self.BASE_FREQS).ravel()
 
     def _initialize_patterns(self):
         # Define 7 distinct patterns
@@ -141,101 +221,165 @@ class AudioEngine:
         
         return patterns
 
+    def _compile_pattern(self, pattern):
+        # step -> bitmask of drums that hit on that step
+        step_masks = []
+        for step in range(16):
+            mask = 0
+            for name, idx in self.drum_idx.items():
+                if name in pattern and pattern[name][step]:
+                    mask |= 1 << idx
+            step_masks.append(mask)
+        return tuple(step_masks)
+
     def _precompute_synth_sounds(self):
         sounds = []
         sample_rate = 44100
         duration = 0.2 # Short blip for arpeggio
         
-        for freq in self.scale:
-            # Generate Sine Wave
-            t = np.linspace(0, duration, int(sample_rate * duration), False)
-            wave = np.sin(2 * np.pi * freq * t)
-            
-            # Simple Envelope (Attack/Decay)
-            envelope = np.concatenate([
-                np.linspace(0, 1, int(sample_rate * 0.01)), # Attack
-                np.linspace(1, 0, int(sample_rate * (duration - 0.01))) # Decay
-            ])
-            wave = wave * envelope
-            
-            # Convert to 16-bit PCM
-            audio = (wave * 32767).astype(np.int16)
-            # Stereo
-            stereo = np.column_stack((audio, audio))
+        # Time base and envelope are identical for every note, build them once
+        # (float32 is plenty for audio that ends up as int16)
+        samples = int(sample_rate * duration)
+        # Sample indices; 1/sample_rate is folded into each note's phase step
+        n = np.arange(samples, dtype=np.float32)
+        
+        # Simple Envelope (Attack/Decay) with the int16 full-scale factor folded in,
+        # so each note needs a single multiply
+        envelope = _synth_envelope(samples, int(sample_rate * 0.01))
+        
+        # Match the mixer layout (it may have been opened in stereo elsewhere)
+        channels = pygame.mixer.get_init()[2]
+        
+        # Render every note at once: one (notes, samples) phase grid, then
+        # sine, envelope and int16 conversion each run as a single 2-D pass
+        omega = np.asarray(self.scale, dtype=np.float32) * np.float32(2 * np.pi / sample_rate)
+        waves = np.multiply.outer(omega, n)
+        np.sin(waves, out=waves)
+        waves *= envelope
+        # |sin| * envelope never exceeds full scale, no clip needed; round to
+        # nearest and write straight into the int16 output in the same pass
+        pcm = np.empty(waves.shape, dtype=np.int16)
+        np.rint(waves, out=pcm, casting='unsafe')
+        
+        for audio in pcm:
+            # Duplicate the mono signal per channel only when the mixer needs it
+            if channels > 1:
+                audio = np.repeat(audio, channels)
             
-            sound = pygame.sndarray.make_sound(stereo)
+            # The mixer copies straight from the array, no intermediate bytes object
+            sound = pygame.mixer.Sound(buffer=audio)
             sounds.append(sound)
         return sounds
 
     def _scheduler_loop(self):
-        next_step_time = time.time()
+        # Deadlines are integer nanoseconds so they never drift however long
+        # the session runs; a late step is caught up instead of shifting the grid
+        next_step_ns = time.perf_counter_ns()
         while self.running:
-            current_time = time.time()
-            if current_time >= next_step_time:
-                self._play_step(self.current_step)
-                self.current_step = (self.current_step + 1) % 16
-                next_step_time += self.step_duration
-            else:
-                time.sleep(0.001)
+            delay_ns = next_step_ns - time.perf_counter_ns()
+            if delay_ns > 0:
+                # Sleep until the step is due instead of polling every millisecond
+                self._wake.wait(timeout=delay_ns / 1e9)
+                self._wake.clear()
+                continue
+            self._play_step(self.current_step)
+            self.current_step = (self.current_step + 1) % 16
+            next_step_ns += self.step_duration_ns
 
     def _play_step(self, step):
+        # Only snapshot shared state under the lock; the mixer calls below can
+        # take a while and must not block the gesture thread's updates
+        offset = _ARP_OFFSETS[step & 3]
+        voice = step % self.ARP_VOICES
         with self.lock:
-            # Play Drums
-            # Play Drums
-            # Check active drums (finger mapping) OR play full pattern if desired
-            # The user wants "Pattern for the drum".
-            # If we just play the pattern, we don't need active_drums?
-            # Or maybe active_drums enables the instrument?
-            # Let's assume active_drums acts as a MUTE/UNMUTE mask for the pattern.
-            # So if you hold "Kick" finger, the Kick track of the pattern plays.
-            
-            for drum_name in self.active_drums:
-                if drum_name in self.drum_pattern and self.drum_pattern[drum_name][step]:
-                    if drum_name in self.drums:
-                        self.drums[drum_name].play()
-            
-            # Play Arpeggios
-            for hand_idx, arp_data in self.active_arpeggios.items():
-                # Simple Up/Down pattern logic
-                # For now, just play the root note or a simple interval
-                # The JS version does a complex pattern. Let's do a simple chord arpeggio.
-                # Root, +3 (min 3rd), +5 (4th), +7 (5th) indices in our scale?
-                # Let's just play the note corresponding to the hand height for now, 
-                # or a simple sequence based on the step.
-                
-                root_idx = arp_data['note_index']
-                # Create a pattern: Root, +1, +2, +1 (relative to scale index)
-                offsets = [0, 2, 4, 2] 
-                offset = offsets[step % 4]
-                
-                note_idx = root_idx + offset
-                if 0 <= note_idx < len(self.synth_sounds):
-                    vol = arp_data.get('volume', 0.5)
-                    sound = self.synth_sounds[note_idx]
-                    sound.set_volume(vol)
-                    sound.play()
+            hits = self.step_masks[step] & self.active_mask
+            arps = [(arp['note_index'] + offset, arp['volume'], arp['channels'][voice])
+                    for arp in self.active_arpeggios.values()]
+        
+        # Play Drums
+        # Check active drums (finger mapping) OR play full pattern if desired
+        # The user wants "Pattern for the drum".
+        # If we just play the pattern, we don't need active_drums?
+        # Or maybe active_drums enables the instrument?
+        # Let's assume active_drums acts as a MUTE/UNMUTE mask for the pattern.
+        # So if you hold "Kick" finger, the Kick track of the pattern plays.
+        if hits:
+            self.played_hits.append((time.perf_counter_ns(), hits))
+        drum_play = self.drum_play
+        idx = 0
+        while hits:
+            if hits & 1:
+                drum_play[idx]()
+            hits >>= 1
+            idx += 1
+        
+        # Play Arpeggios
+        # Simple Up/Down pattern logic: the note for the hand height plus the
+        # step's offset from _ARP_OFFSETS (indices in our scale)
+        synth_sounds = self.synth_sounds
+        num_notes = len(synth_sounds)
+        for note_idx, volume, channel in arps:
+            if 0 <= note_idx < num_notes:
+                channel.set_volume(volume)
+                channel.play(synth_sounds[note_idx])
 
     def update_drums(self, active_drums_set):
-        with self.lock:
-            self.active_drums = active_drums_set
+        # Called every camera frame; no lock needed since rebinding an int is
+        # atomic and the scheduler at worst sees the previous mask for one tick
+        drum_idx = self.drum_idx
+        mask = 0
+        for name in active_drums_set:
+            idx = drum_idx.get(name)
+            if idx is not None:
+                mask |= 1 << idx
+        self.active_drums = active_drums_set
+        self.active_mask = mask
+
+    def pop_played_drums(self):
+        # (drum name, level) for every hit played since the last call, oldest first.
+        # Hits that piled up while nobody drained them (processor paused, camera
+        # stalled) are dropped so they don't all flash at once on resume
+        played = []
+        oldest_ns = time.perf_counter_ns() - self.PLAYED_HIT_MAX_AGE_NS
+        while self.played_hits:
+            played_ns, hits = self.played_hits.popleft()
+            if played_ns < oldest_ns:
+                continue
+            for idx, name in enumerate(self.drum_names):
+                if hits >> idx & 1:
+                    played.append((name, self.DRUM_VOLUMES.get(name, 1.0)))
+        return played
 
     def next_pattern(self):
         with self.lock:
             self.current_pattern_index = (self.current_pattern_index + 1) % len(self.patterns)
             self.drum_pattern = self.patterns[self.current_pattern_index]
-            print(f"Switched to Pattern {self.current_pattern_index + 1}")
-            return self.current_pattern_index + 1
+            self.step_masks = self.pattern_masks[self.current_pattern_index]
+            pattern_number = self.current_pattern_index + 1
+        if self.verbose:
+            print(f"Switched to Pattern {pattern_number}")
+        return pattern_number
 
     def set_pattern(self, index):
+        if not 0 <= index < len(self.patterns):
+            return
         with self.lock:
-            if 0 <= index < len(self.patterns):
-                self.current_pattern_index = index
-                self.drum_pattern = self.patterns[index]
-                print(f"Set Pattern to {index + 1}")
+            self.current_pattern_index = index
+            self.drum_pattern = self.patterns[index]
+            self.step_masks = self.pattern_masks[index]
+        if self.verbose:
+            print(f"Set Pattern to {index + 1}")
 
     def start_arpeggio(self, hand_idx, note_index):
         with self.lock:
-            self.active_arpeggios[hand_idx] = {'note_index': note_index, 'volume': 0.5}
+            self._start_arpeggio_locked(hand_idx, note_index)
+
+    def _start_arpeggio_locked(self, hand_idx, note_index):
+        # Caller must hold self.lock (a plain Lock, not re-entrant)
+        # Give the hand a block of reserved voices no other arpeggio is using
+        busy = [arp['channels'] for arp in self.active_arpeggios.values()]
+        channels = next((c for c in self.arp_channels if c not in busy), self.arp_channels[0])
+        self.active_arpeggios[hand_idx] = {'note_index': note_index, 'volume': 0.5, 'channels': channels}
 
     def update_arpeggio(self, hand_idx, note_index, volume):
         with self.lock:
@@ -243,7 +387,7 @@ class AudioEngine:
                 self.active_arpeggios[hand_idx]['note_index'] = note_index
                 self.active_arpeggios[hand_idx]['volume'] = volume
             else:
-                self.start_arpeggio(hand_idx, note_index)
+                self._start_arpeggio_locked(hand_idx, note_index)
 
     def stop_arpeggio(self, hand_idx):
         with self.lock:
@@ -251,12 +395,16 @@ class AudioEngine:
                 del self.active_arpeggios[hand_idx]
     
     def set_bpm(self, bpm):
+        if bpm == self.bpm:
+            return
         with self.lock:
             self.bpm = bpm
             self.step_duration = (60 / self.bpm) / 4
+            self.step_duration_ns = int(15e9 / self.bpm)
 
     def cleanup(self):
         self.running = False
+        self._wake.set()
         self.scheduler_thread.join()
         # Do not quit mixer here if other parts might use it, but usually it's fine
         # pygame.mixer.quit() 
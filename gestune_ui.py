@@ -11,7 +11,6 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import Qt, pyqtSignal, QTimer, QSize, QPropertyAnimation, QEasingCurve, pyqtProperty
 from PyQt6.QtGui import QImage, QPixmap, QFont, QIcon, QPainter, QColor
-import cv2
 import numpy as np
 from typing import Optional, Dict, List, Tuple
 from enum import Enum
@@ -849,14 +848,15 @@ class GestuneUI(QMainWindow):
             return
         
         try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            h, w, ch = rgb_frame.shape
+            # Qt reads BGR directly, so no extra color conversion pass is needed
+            bgr_frame = np.ascontiguousarray(frame)
+            h, w, ch = bgr_frame.shape
             bytes_per_line = ch * w
             qt_image = QImage(
-                rgb_frame.data, 
+                bgr_frame.data, 
                 w, h, 
                 bytes_per_line, 
-                QImage.Format.Format_RGB888
+                QImage.Format.Format_BGR888
             )
             
             # Scale to fit exactly without black bars
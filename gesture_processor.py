@@ -6,7 +6,9 @@ Handles hand tracking, music generation, and frame processing
 import cv2
 import numpy as np
 import time
-from typing import Dict, Optional, Tuple, List
+import threading
+from collections import deque
+from typing import Deque, Dict, FrozenSet, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 from PyQt6.QtCore import QThread, pyqtSignal
@@ -31,6 +33,22 @@ class ProcessingStats:
     dropped_frames: int = 0
 
 
+def _build_finger_drum_table(finger_drums: Tuple[str, ...]) -> Tuple[FrozenSet[str], ...]:
+    """
+    Build the drum set for every combination of extended fingers.
+    
+    Args:
+        finger_drums: Drum name per finger, thumb first
+        
+    Returns:
+        Tuple indexed by finger bitmask (bit i = finger i extended)
+    """
+    return tuple(
+        frozenset(drum for i, drum in enumerate(finger_drums) if mask >> i & 1)
+        for mask in range(1 << len(finger_drums))
+    )
+
+
 class GestureProcessor(QThread):
     """
     Background thread for processing hand gestures and generating music.
@@ -60,12 +78,49 @@ class GestureProcessor(QThread):
     COLOR_RIGHT_HAND = (255, 150, 100)  # Orange for drums
     COLOR_LANDMARK = (255, 255, 255)  # White
     
-    def __init__(self):
+    # MediaPipe hand connections (landmark index pairs)
+    HAND_CONNECTIONS = np.array([
+        # Thumb
+        (0, 1), (1, 2), (2, 3), (3, 4),
+        # Index finger
+        (0, 5), (5, 6), (6, 7), (7, 8),
+        # Middle finger
+        (0, 9), (9, 10), (10, 11), (11, 12),
+        # Ring finger
+        (0, 13), (13, 14), (14, 15), (15, 16),
+        # Pinky
+        (0, 17), (17, 18), (18, 19), (19, 20),
+        # Palm
+        (5, 9), (9, 13), (13, 17)
+    ], dtype=np.intp)
+    
+    # Landmarks that get a number label (wrist and fingertips)
+    LABELED_LANDMARKS = frozenset((0, 4, 8, 12, 16, 20))
+    
+    # Right-hand finger index -> drum
+    # 0: Thumb -> Kick
+    # 1: Index -> Snare
+    # 2: Middle -> Hihat
+    # 3: Ring -> Clap (mapped to crash in engine for now)
+    # 4: Pinky -> Clap as well
+    FINGER_DRUMS = ('kick', 'snare', 'hihat', 'clap', 'clap')
+    # Every 5-finger combination (bit i = finger i extended) -> its drum set,
+    # so mapping a pose is a single index instead of building a new set
+    FINGER_DRUM_TABLE = _build_finger_drum_table(FINGER_DRUMS)
+    
+    def __init__(self, debug: bool = False):
+        """
+        Initialize the gesture processor.
+        
+        Args:
+            debug: Print per-frame gesture diagnostics
+        """
         super().__init__()
         
         # Thread control
         self.running = False
         self.paused = False
+        self.debug = debug
         
         # Components
         self.cap: Optional[cv2.VideoCapture] = None
@@ -75,8 +130,8 @@ class GestureProcessor(QThread):
         # Performance tracking
         self.stats = ProcessingStats()
         self.last_fps_time = time.time()
-        self.frame_times: List[float] = []
         self.max_frame_times = 30
+        self.frame_times: Deque[float] = deque(maxlen=self.max_frame_times)
         
         # State tracking
         self.last_hand_states: Dict[str, bool] = {
@@ -84,6 +139,16 @@ class GestureProcessor(QThread):
             HandSide.RIGHT.value: False
         }
         
+        # Last right-hand finger state sent to the drum engine
+        self.last_drum_fingers: Optional[int] = None
+        self.current_drums: FrozenSet[str] = frozenset()
+        
+        # Camera capture thread (producer) -> processing loop (consumer)
+        self._capture_thread: Optional[threading.Thread] = None
+        self._frame_lock = threading.Lock()
+        self._frame_ready = threading.Event()
+        self._latest_frame: Optional[np.ndarray] = None
+        
         # Frame processing
         self.last_frame_time = time.time()
         self.frame_skip_counter = 0
@@ -95,6 +160,11 @@ class GestureProcessor(QThread):
         self.bpm_last_height = None
         self.bpm_last_update_time = 0
         self.bpm_smoothing = 0.05
+        self.bpm_last_value = None
+
+        # Fist gesture -> next drum pattern (monotonic clock, immune to wall-clock jumps)
+        self.pattern_change_cooldown = 2.0
+        self.last_pattern_change_time = float('-inf')
 
         
     def setup(self) -> bool:
@@ -150,21 +220,30 @@ class GestureProcessor(QThread):
         self.running = True
         self.last_fps_time = time.time()
         
+        # Decode camera frames on their own thread so capture overlaps processing
+        self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._capture_thread.start()
+        
         try:
             while self.running:
                 if self.paused:
                     time.sleep(0.1)
                     continue
                 
-                loop_start = time.time()
+                # Wait for the next captured frame
+                if not self._frame_ready.wait(timeout=0.1):
+                    continue
                 
-                # Capture frame
-                ret, frame = self.cap.read()
-                if not ret:
-                    self.stats.dropped_frames += 1
-                    time.sleep(0.01)
+                with self._frame_lock:
+                    frame = self._latest_frame
+                    self._latest_frame = None
+                    self._frame_ready.clear()
+                
+                if frame is None:
                     continue
                 
+                loop_start = time.time()
+                
                 # Mirror frame for intuitive control
                 frame = cv2.flip(frame, 1)
                 
@@ -176,9 +255,7 @@ class GestureProcessor(QThread):
                 
                 # Calculate and maintain frame rate
                 frame_time = time.time() - loop_start
-                self.frame_times.append(frame_time)
-                if len(self.frame_times) > self.max_frame_times:
-                    self.frame_times.pop(0)
+                self.frame_times.append(frame_time)  # Oldest sample drops off
                 
                 # Sleep to maintain target frame rate
                 sleep_time = max(0, self.TARGET_FRAME_TIME - frame_time)
@@ -193,6 +270,19 @@ class GestureProcessor(QThread):
         finally:
             self.cleanup()
     
+    def _capture_loop(self):
+        """Read camera frames, keeping only the most recent one for processing."""
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                self.stats.dropped_frames += 1
+                time.sleep(0.01)
+                continue
+            
+            with self._frame_lock:
+                self._latest_frame = frame
+                self._frame_ready.set()
+    
     def _process_frame(self, frame: np.ndarray):
         """
         Process a single frame for hand detection and music generation.
@@ -233,7 +323,8 @@ class GestureProcessor(QThread):
 
                     # === STEP A: Ambil gesture BPM ===
                     right_pinch = self.tracker.get_pinch_distance("Right")
-                    print(f"[DEBUG] Right pinch = {right_pinch:.3f}")
+                    if self.debug:
+                        print(f"[DEBUG] Right pinch = {right_pinch:.3f}")
                     right_height = 1.0 - hand_info["wrist_y"]
 
                     # === STEP B: Lock / Unlock BPM ===
@@ -273,9 +364,14 @@ class GestureProcessor(QThread):
                 self.hand_detected.emit("right", right_detected)
                 self.last_hand_states[HandSide.RIGHT.value] = right_detected
                 
-                # Stop drums if hand lost
-                if not right_detected and self.audio:
-                    self.audio.update_drums(set())
+                # Stop drums if hand lost (once, and only if any were mapped)
+                if not right_detected and self.audio and self.last_drum_fingers is not None:
+                    self.current_drums = self.FINGER_DRUM_TABLE[0]
+                    self.audio.update_drums(self.current_drums)
+                    self.last_drum_fingers = None
+            
+            # Flash the drums the sequencer actually played since the last frame
+            self._emit_drum_hits()
             
             # Draw performance overlay
             self._draw_performance_overlay(frame)
@@ -318,11 +414,8 @@ class GestureProcessor(QThread):
                 self.audio.update_arpeggio("left_hand", note_index, volume)
                 
                 # Emit note information (approximate for UI)
-                # We can emit the frequency or just the index
-                freq = self.audio.scale[note_index]
-                # Convert freq to midi for UI display if needed, or just emit index
-                # MIDI = 69 + 12 * log2(freq/440)
-                midi_note = int(69 + 12 * np.log2(freq/440))
+                # MIDI numbers are precomputed per scale index by the engine
+                midi_note = self.audio.scale_midi[note_index]
                 self.note_played.emit(midi_note, volume)
                 
         except Exception as e:
@@ -339,55 +432,47 @@ class GestureProcessor(QThread):
         try:
             # Get which fingers are extended
             fingers_extended = self.tracker.get_fingers_extended(HandSide.RIGHT.value)
-            
-            # Map fingers to drums
-            # 0: Thumb -> Kick
-            # 1: Index -> Snare
-            # 2: Middle -> Hihat
-            # 3: Ring -> Clap (mapped to crash in engine for now)
-            # 4: Pinky -> Crash (not in engine default, maybe ignore or map to clap too)
-            
-            active_drums = set()
-            drum_map = {0: 'kick', 1: 'snare', 2: 'hihat', 3: 'clap', 4: 'clap'}
-            
+            finger_mask = 0
             for i, is_extended in enumerate(fingers_extended):
-                if is_extended and i in drum_map:
-                    active_drums.add(drum_map[i])
+                if is_extended:
+                    finger_mask |= 1 << i
+            
+            # Map fingers to drums (only when the finger state actually changed;
+            # most frames hold the same pose)
+            if finger_mask != self.last_drum_fingers:
+                self.last_drum_fingers = finger_mask
+                self.current_drums = self.FINGER_DRUM_TABLE[finger_mask]
+                if self.audio:
+                    self.audio.update_drums(self.current_drums)
             
             if self.audio:
-                self.audio.update_drums(active_drums)
-                
                 # Check for fist (pattern change)
                 # We need a cooldown to prevent rapid switching
-                current_time = time.time()
-                is_fist = self.tracker.is_fist(HandSide.RIGHT.value)
+                current_time = time.monotonic()
                 
-                # Check if enough time passed since last pattern change (e.g., 2 seconds)
-                if not hasattr(self, 'last_pattern_change_time'):
-                    self.last_pattern_change_time = 0
-                
-                if is_fist and (current_time - self.last_pattern_change_time > 2.0):
+                # Skip the fist check entirely while still cooling down
+                if (current_time - self.last_pattern_change_time > self.pattern_change_cooldown
+                        and self.tracker.is_fist(HandSide.RIGHT.value)):
                     new_pattern_idx = self.audio.next_pattern()
                     self.last_pattern_change_time = current_time
                     self.pattern_changed.emit(new_pattern_idx - 1) # UI expects 0-indexed
                     print(f"✊ Fist detected! Switching to Pattern {new_pattern_idx}")
-            
-            # Emit drum hits for UI visualization
-            # Since the engine handles timing, we might not know exactly when it hits
-            # unless we add a callback or just visualize the active state.
-            # For now, we can emit "active" drums as hits with low velocity just to show they are selected?
-            # Or better, just don't emit hits if we can't sync.
-            # The UI uses drum_hit to flash the drum. 
-            # Let's emit a hit if it's active, but maybe throttle it?
-            # Actually, the old code emitted hits when they were PLAYED by the sequencer.
-            # The new engine doesn't report back when a note is played.
-            # We will just emit the active drums so the UI knows they are "on".
-            for drum in active_drums:
-                 self.drum_hit.emit(drum, 0.5)
 
         except Exception as e:
             print(f"Drum processing error: {e}")
     
+    def _emit_drum_hits(self):
+        """
+        Forward drum hits played by the audio engine to the UI.
+        
+        The engine's scheduler thread records every step it plays; draining
+        them here keeps the drum indicators in sync with what is heard.
+        """
+        if not self.audio:
+            return
+        for drum, velocity in self.audio.pop_played_drums():
+            self.drum_hit.emit(drum, velocity)
+    
     def _draw_hand_on_frame(
         self, 
         frame: np.ndarray, 
@@ -411,15 +496,20 @@ class GestureProcessor(QThread):
             landmarks = hand_info['landmarks'].landmark
             h, w = frame.shape[:2]
             
+            # Convert all landmarks to pixel coordinates in one pass
+            points = (
+                np.array([(lm.x, lm.y) for lm in landmarks], dtype=np.float32).reshape(-1, 2) * (w, h)
+            ).astype(np.int32)
+            
             # Draw hand connections
-            self._draw_hand_connections(frame, landmarks, w, h, color)
+            self._draw_hand_connections(frame, points, color)
             
             # Draw landmarks
-            self._draw_landmarks(frame, landmarks, w, h, color)
+            self._draw_landmarks(frame, points, color)
             
             # Draw label
-            if len(landmarks) > 0:
-                self._draw_hand_label(frame, landmarks[0], w, h, label_text, color)
+            if len(points) > 0:
+                self._draw_hand_label(frame, points[0], label_text, color)
                 
         except Exception as e:
             print(f"Hand drawing error: {e}")
@@ -427,53 +517,25 @@ class GestureProcessor(QThread):
     def _draw_hand_connections(
         self, 
         frame: np.ndarray, 
-        landmarks, 
-        w: int, 
-        h: int, 
+        points: np.ndarray, 
         color: Tuple[int, int, int]
     ):
         """Draw lines connecting hand landmarks."""
-        # MediaPipe hand connections
-        connections = [
-            # Thumb
-            (0, 1), (1, 2), (2, 3), (3, 4),
-            # Index finger
-            (0, 5), (5, 6), (6, 7), (7, 8),
-            # Middle finger
-            (0, 9), (9, 10), (10, 11), (11, 12),
-            # Ring finger
-            (0, 13), (13, 14), (14, 15), (15, 16),
-            # Pinky
-            (0, 17), (17, 18), (18, 19), (19, 20),
-            # Palm
-            (5, 9), (9, 13), (13, 17)
-        ]
-        
-        for start_idx, end_idx in connections:
-            if start_idx >= len(landmarks) or end_idx >= len(landmarks):
-                continue
-            
-            start = landmarks[start_idx]
-            end = landmarks[end_idx]
-            
-            start_point = (int(start.x * w), int(start.y * h))
-            end_point = (int(end.x * w), int(end.y * h))
-            
-            # Draw connection line
-            cv2.line(frame, start_point, end_point, color, 2, cv2.LINE_AA)
+        connections = self.HAND_CONNECTIONS
+        if len(points) <= connections.max():
+            connections = connections[(connections < len(points)).all(axis=1)]
+        
+        # Draw all connection lines in a single call
+        cv2.polylines(frame, list(points[connections]), False, color, 2, cv2.LINE_AA)
     
     def _draw_landmarks(
         self, 
         frame: np.ndarray, 
-        landmarks, 
-        w: int, 
-        h: int, 
+        points: np.ndarray, 
         color: Tuple[int, int, int]
     ):
         """Draw individual landmark points."""
-        for idx, landmark in enumerate(landmarks):
-            x, y = int(landmark.x * w), int(landmark.y * h)
-            
+        for idx, (x, y) in enumerate(points.tolist()):
             # Draw filled circle for landmark
             cv2.circle(frame, (x, y), 5, color, -1, cv2.LINE_AA)
             
@@ -481,7 +543,7 @@ class GestureProcessor(QThread):
             cv2.circle(frame, (x, y), 7, self.COLOR_LANDMARK, 2, cv2.LINE_AA)
             
             # Draw landmark number for key points
-            if idx in [0, 4, 8, 12, 16, 20]:  # Wrist and fingertips
+            if idx in self.LABELED_LANDMARKS:
                 cv2.putText(
                     frame, 
                     str(idx), 
@@ -496,9 +558,7 @@ class GestureProcessor(QThread):
     def _draw_hand_label(
         self, 
         frame: np.ndarray, 
-        wrist_landmark, 
-        w: int, 
-        h: int, 
+        wrist_point: np.ndarray, 
         text: str, 
         color: Tuple[int, int, int]
     ):
@@ -507,14 +567,12 @@ class GestureProcessor(QThread):
         
         Args:
             frame: Frame to draw on
-            wrist_landmark: Wrist landmark for positioning
-            w: Frame width
-            h: Frame height
+            wrist_point: Wrist position in pixels (x, y)
             text: Label text
             color: Label color (BGR)
         """
-        label_x = int(wrist_landmark.x * w)
-        label_y = int(wrist_landmark.y * h) - 40
+        label_x = int(wrist_point[0])
+        label_y = int(wrist_point[1]) - 40
         
         # Text properties
         font = cv2.FONT_HERSHEY_SIMPLEX
@@ -530,9 +588,7 @@ class GestureProcessor(QThread):
         bg_y2 = label_y + padding
         
         # Draw semi-transparent background
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (bg_x1, bg_y1), (bg_x2, bg_y2), (0, 0, 0), -1)
-        cv2.addWeighted(overlay, 0.6, frame, 0.4, 0, frame)
+        self._darken_region(frame, bg_x1, bg_y1, bg_x2, bg_y2, 0.6)
         
         # Draw border
         cv2.rectangle(frame, (bg_x1, bg_y1), (bg_x2, bg_y2), color, 2, cv2.LINE_AA)
@@ -557,12 +613,8 @@ class GestureProcessor(QThread):
             frame: Frame to draw on
         """
         try:
-            h, w = frame.shape[:2]
-            overlay = frame.copy()
-            
             # Draw semi-transparent background
-            cv2.rectangle(overlay, (10, 10), (300, 120), (0, 0, 0), -1)
-            cv2.addWeighted(overlay, 0.5, frame, 0.5, 0, frame)
+            self._darken_region(frame, 10, 10, 300, 120, 0.5)
             
             # Prepare text
             font = cv2.FONT_HERSHEY_SIMPLEX
@@ -587,6 +639,34 @@ class GestureProcessor(QThread):
         except Exception as e:
             print(f"Overlay drawing error: {e}")
     
+    def _darken_region(
+        self, 
+        frame: np.ndarray, 
+        x1: int, 
+        y1: int, 
+        x2: int, 
+        y2: int, 
+        alpha: float
+    ):
+        """
+        Blend a black rectangle into the frame, touching only that region.
+        
+        Args:
+            frame: Frame to draw on (modified in place)
+            x1, y1: Top-left corner (inclusive)
+            x2, y2: Bottom-right corner (inclusive)
+            alpha: Opacity of the black box (0-1)
+        """
+        h, w = frame.shape[:2]
+        x1, x2 = max(0, x1), min(w, x2 + 1)
+        y1, y2 = max(0, y1), min(h, y2 + 1)
+        if x1 >= x2 or y1 >= y2:
+            return
+        
+        roi = frame[y1:y2, x1:x2]
+        # Scale the view towards black, writing straight back into the frame
+        cv2.convertScaleAbs(roi, dst=roi, alpha=1.0 - alpha)
+    
     def _update_fps(self):
         """Calculate and emit FPS updates."""
         self.stats.frame_count += 1
@@ -607,6 +687,8 @@ class GestureProcessor(QThread):
         Args:
             bpm: Beats per minute
         """
+        # Shared with the gesture path so a UI change isn't mistaken for "unchanged"
+        self.bpm_last_value = bpm
         try:
             if self.audio:
                 self.audio.set_bpm(bpm)
@@ -639,9 +721,10 @@ class GestureProcessor(QThread):
         self.bpm_last_height = smoothed_bpm
         self.bpm_last_update_time = current_time
 
-        # Update ke arpeggiator & drum machine
+        # Update ke arpeggiator & drum machine (hanya kalau nilainya berubah)
         bpm_int = int(smoothed_bpm)
-        self.set_bpm(bpm_int)
+        if bpm_int != self.bpm_last_value:
+            self.set_bpm(bpm_int)
 
     
     def change_pattern(self, pattern_index: Optional[int] = None):
@@ -672,6 +755,11 @@ class GestureProcessor(QThread):
     def cleanup(self):
         """Clean up resources."""
         try:
+            # Stop the capture thread before releasing the camera it reads from
+            self.running = False
+            if self._capture_thread and self._capture_thread.is_alive():
+                self._capture_thread.join(timeout=1.0)
+            
             # Release camera
             if self.cap and self.cap.isOpened():
                 self.cap.release()
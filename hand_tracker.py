@@ -4,10 +4,11 @@ Enhanced MediaPipe-based hand tracking with ROI zones, gesture recognition,
 and smoothing filters for robust real-time control.
 """
 
+import math
 import cv2
 import mediapipe as mp
 import numpy as np
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
@@ -100,11 +101,15 @@ class HandTracker:
     LANDMARK_PINKY_TIP = 20
     LANDMARK_PINKY_PIP = 18
     
+    # Finger state reported for a hand that is not being tracked
+    NO_FINGERS_EXTENDED = (False, False, False, False, False)
+    
     # Default configuration
     DEFAULT_DETECTION_CONFIDENCE = 0.7
     DEFAULT_TRACKING_CONFIDENCE = 0.7
     DEFAULT_SMOOTHING_FACTOR = 0.3
     DEFAULT_ROI_MARGIN = 0.05
+    DEFAULT_PROCESS_WIDTH = 640
     
     def __init__(
         self,
@@ -113,7 +118,8 @@ class HandTracker:
         tracking_confidence: float = DEFAULT_TRACKING_CONFIDENCE,
         smoothing_factor: float = DEFAULT_SMOOTHING_FACTOR,
         max_num_hands: int = 2,
-        model_complexity: int = 1
+        model_complexity: int = 1,
+        process_width: int = DEFAULT_PROCESS_WIDTH
     ):
         """
         Initialize hand tracker.
@@ -125,6 +131,8 @@ class HandTracker:
             smoothing_factor: Temporal smoothing factor (0-1, higher = more smoothing)
             max_num_hands: Maximum number of hands to detect
             model_complexity: MediaPipe model complexity (0=lite, 1=full)
+            process_width: Frames wider than this are downscaled before
+                detection (0 = always use full resolution)
         """
         # Initialize MediaPipe
         self.mp_hands = mp.solutions.hands
@@ -145,11 +153,15 @@ class HandTracker:
         # Tracking state
         self.results: Optional[any] = None
         self.hand_data: Dict[str, HandData] = {}
+        self._fingers_cache: Dict[str, Tuple[bool, ...]] = {}
         
         # Smoothing
         self.smoothing_factor = smoothing_factor
         self.prev_values: Dict[str, float] = {}
         
+        # Inference resolution
+        self.process_width = process_width
+        
         # ROI configuration
         self.enable_roi = enable_roi
         self.roi_zones: Dict[str, ROIZone] = {
@@ -184,12 +196,21 @@ class HandTracker:
             frame: Input BGR frame from camera
             
         Returns:
-            Dictionary mapping hand labels to hand data dictionaries
+            Dictionary mapping hand labels to hand data dictionaries. The same
+            dictionary is refilled on every call; copy it to keep a snapshot.
         """
         if frame is None or frame.size == 0:
             return {}
         
         try:
+            # Downscale for MediaPipe (landmarks are normalized, no remap needed)
+            frame_width = frame.shape[1]
+            if self.process_width and frame_width > self.process_width:
+                scale = self.process_width / frame_width
+                frame = cv2.resize(
+                    frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+                )
+            
             # Convert to RGB for MediaPipe
             rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             rgb_frame.flags.writeable = False
@@ -200,8 +221,10 @@ class HandTracker:
             rgb_frame.flags.writeable = True
             self.frame_count += 1
             
-            # Reset hand data
-            self.hand_data = {}
+            # Reset hand data (and gestures derived from the previous frame),
+            # reusing the containers instead of allocating new ones per frame
+            self.hand_data.clear()
+            self._fingers_cache.clear()
             
             # Process detected hands
             if self.results.multi_hand_landmarks and self.results.multi_handedness:
@@ -330,10 +353,11 @@ class HandTracker:
             thumb = self.hand_data[hand_label]['thumb_tip']
             index = self.hand_data[hand_label]['index_tip']
             
-            distance = np.sqrt(
-                (thumb.x - index.x)**2 +
-                (thumb.y - index.y)**2 +
-                (thumb.z - index.z)**2
+            # Plain math on scalars, NumPy ufunc dispatch costs more than the work
+            distance = math.hypot(
+                thumb.x - index.x,
+                thumb.y - index.y,
+                thumb.z - index.z
             )
             return self._smooth_value(f'{hand_label}_pinch', distance)
         return 0.1
@@ -368,7 +392,7 @@ class HandTracker:
         total_distance = 0.0
         for idx in fingertip_indices:
             tip = landmarks[idx]
-            distance = np.sqrt((tip.x - center_x)**2 + (tip.y - center_y)**2)
+            distance = math.hypot(tip.x - center_x, tip.y - center_y)
             total_distance += distance
         
         avg_distance = total_distance / len(fingertip_indices)
@@ -397,7 +421,7 @@ class HandTracker:
         
         dx = index.x - thumb.x
         dy = index.y - thumb.y
-        angle = np.degrees(np.arctan2(dy, dx))
+        angle = math.degrees(math.atan2(dy, dx))
         
         key = f"{hand_label}_rotation_angle"
         prev_angle = self.prev_values.get(key, angle)
@@ -414,18 +438,26 @@ class HandTracker:
         delta_smoothed = self._smooth_value(f"{hand_label}_rot_delta", delta)
         return delta_smoothed
     
-    def get_fingers_extended(self, hand_label: str) -> List[bool]:
+    def get_fingers_extended(self, hand_label: str) -> Tuple[bool, ...]:
         """
         Check which fingers are extended.
         
+        The result is computed once per processed frame and shared by the
+        gesture checks (fist, pointing, peace sign) for the same hand, so it
+        is an immutable tuple.
+        
         Args:
             hand_label: Hand label (Left/Right)
             
         Returns:
-            List of 5 booleans [thumb, index, middle, ring, pinky]
+            Tuple of 5 booleans (thumb, index, middle, ring, pinky)
         """
         if hand_label not in self.hand_data:
-            return [False] * 5
+            return self.NO_FINGERS_EXTENDED
+        
+        cached = self._fingers_cache.get(hand_label)
+        if cached is not None:
+            return cached
         
         landmarks = self.hand_data[hand_label]['landmarks'].landmark
         
@@ -441,7 +473,9 @@ class HandTracker:
         ring_extended = landmarks[self.LANDMARK_RING_TIP].y < landmarks[self.LANDMARK_RING_PIP].y
         pinky_extended = landmarks[self.LANDMARK_PINKY_TIP].y < landmarks[self.LANDMARK_PINKY_PIP].y
         
-        return [thumb_extended, index_extended, middle_extended, ring_extended, pinky_extended]
+        fingers = (thumb_extended, index_extended, middle_extended, ring_extended, pinky_extended)
+        self._fingers_cache[hand_label] = fingers
+        return fingers
     
     def is_fist(self, hand_label: str) -> bool:
         """
@@ -780,6 +814,8 @@ if __name__ == "__main__":
         print("❌ Cannot open camera")
         exit()
     
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Minimize latency
+    
     print("🎥 Camera opened. Press 'q' to quit, 's' for stats")
     
     try: